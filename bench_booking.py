@@ -0,0 +1,62 @@
+# Concurrency benchmark for the booking engine.
+# Hundreds of threads hold and buy seats for a few showings at once, each
+# purchase is retried with the same idempotency key, and the results are
+# checked for double-sells against both memory and the SQLite store.
+#
+# Usage: python bench_booking.py [purchasers] [showings] [seats_per_showing]
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from booking import BookingEngine, BookingError
+
+
+def run(purchasers=800, showings=4, seats_per_showing=150):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = BookingEngine(db_path, seats_per_showing=seats_per_showing)
+    start_barrier = threading.Barrier(purchasers)
+
+    def purchase(i):
+        showing = ("Bench Theater", f"Movie {i % showings}", "7:00 PM")
+        start_barrier.wait()
+        try:
+            hold = engine.hold(*showing)
+            first = engine.purchase(*showing, hold_id=hold.hold_id)
+            retry = engine.purchase(*showing, hold_id=hold.hold_id)
+        except BookingError:
+            return None
+        assert first.booking_id == retry.booking_id, "retry created a second booking"
+        return first.booking_id
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=purchasers) as pool:
+        results = list(pool.map(purchase, range(purchasers)))
+    elapsed = time.perf_counter() - start
+    engine.close()
+
+    booked = [booking_id for booking_id in results if booking_id]
+    expected = min(purchasers, showings * seats_per_showing)
+    with sqlite3.connect(db_path) as db:
+        stored = db.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        per_showing = db.execute(
+            "SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM bookings GROUP BY showing_id)"
+        ).fetchone()[0]
+
+    print(f"Purchasers: {purchasers}, showings: {showings}, seats each: {seats_per_showing}")
+    print(f"Bookings: {len(booked)} (expected {expected}), stored: {stored}")
+    print(f"Most seats sold for one showing: {per_showing}")
+    print(f"Elapsed: {elapsed:.3f}s, {len(booked) / elapsed:.0f} bookings/s")
+
+    assert len(booked) == expected == stored, "bookings lost or oversold"
+    assert len(set(booked)) == len(booked), "duplicate booking ids"
+    assert per_showing <= seats_per_showing, "showing oversold"
+    print("No double-sells.")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,168 @@
+# Microbenchmark for decoding and rendering upstream payloads.
+# Compares the previous approach (full json decode into dicts, output built
+# with +=) against records.py (orjson decode into slotted records, output built
+# with join) on synthetic payloads shaped like TMDb and SerpAPI responses.
+#
+# Usage: python bench_movie_functions.py [iterations]
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+from records import parse_movies, parse_reviews, parse_theaters, render_reviews
+
+# Fields we don't render still have to be decoded; pad payloads like the real ones
+EXTRA_FIELDS = {
+    "adult": False,
+    "backdrop_path": "/abcdefghijklmnopqrstuvwxyz.jpg",
+    "genre_ids": [28, 12, 878],
+    "original_language": "en",
+    "popularity": 1234.567,
+    "vote_average": 7.3,
+    "vote_count": 4321,
+}
+
+
+def make_now_playing(count=20):
+    return json.dumps(
+        {
+            "results": [
+                {
+                    "id": i,
+                    "title": f"Movie {i}",
+                    "release_date": "2024-09-13",
+                    "overview": "An overview of the movie. " * 12,
+                    **EXTRA_FIELDS,
+                }
+                for i in range(count)
+            ]
+        }
+    ).encode()
+
+
+def make_reviews(count=20):
+    return json.dumps(
+        {
+            "results": [
+                {
+                    "author": f"Reviewer {i}",
+                    "author_details": {"rating": 7.0, "avatar_path": "/a.jpg"},
+                    "content": "This review goes on for quite a while. " * 60,
+                    "created_at": "2024-09-14T10:00:00.000Z",
+                    "url": f"https://www.themoviedb.org/review/{i}",
+                    "id": f"review-{i}",
+                    "updated_at": "2024-09-14T10:00:00.000Z",
+                }
+                for i in range(count)
+            ]
+        }
+    ).encode()
+
+
+def make_showtimes(theaters=15, days=7):
+    return json.dumps(
+        {
+            "search_metadata": {"id": "abc", "status": "Success"},
+            "organic_results": [{"title": "Result", "snippet": "x" * 200}] * 10,
+            "showtimes": [
+                {
+                    "day": f"Day {d}",
+                    "theaters": [
+                        {
+                            "name": f"Theater {t}",
+                            "link": "https://example.com",
+                            "distance": "1.2 mi",
+                            "address": "123 Main St",
+                            "showing": [
+                                {"time": ["1:00pm", "4:00pm", "7:00pm"], "type": "2D"},
+                                {"time": ["2:30pm", "9:30pm"], "type": "IMAX"},
+                            ],
+                        }
+                        for t in range(theaters)
+                    ],
+                }
+                for d in range(days)
+            ],
+        }
+    ).encode()
+
+
+def legacy_now_playing(payload):
+    movies = json.loads(payload).get("results", [])
+    formatted_movies = "The TMDb API returned these movies:\n\n"
+    for movie in movies[:10]:
+        formatted_movies += (
+            f"**Title:** {movie.get('title', 'N/A')}\n"
+            f"**Movie ID:** {movie.get('id', 'N/A')}\n"
+            f"**Release Date:** {movie.get('release_date', 'N/A')}\n"
+            f"**Overview:** {movie.get('overview', 'N/A')}\n\n"
+        )
+    return formatted_movies
+
+
+def legacy_reviews(payload):
+    formatted_reviews = ""
+    for review in json.loads(payload)["results"]:
+        formatted_reviews += (
+            f"**Author:** {review.get('author', 'N/A')}\n"
+            f"**Rating:** {review.get('author_details', {}).get('rating', 'N/A')}\n"
+            f"**Content:** {review.get('content', 'N/A')}\n"
+            f"**Created At:** {review.get('created_at', 'N/A')}\n"
+            f"**URL:** {review.get('url', 'N/A')}\n"
+            "----------------------------------------\n"
+        )
+    return formatted_reviews
+
+
+def legacy_showtimes(payload):
+    showtimes = json.loads(payload)["showtimes"][0]
+    formatted_showtimes = "Showtimes:\n\n"
+    theater = showtimes["theaters"][0]
+    formatted_showtimes += f"**{theater.get('name', 'Unknown Theater')}**\n"
+    formatted_showtimes += f"  {showtimes.get('day', 'Unknown Date')}:\n"
+    for showing in theater.get("showing", []):
+        for time in showing.get("time", []):
+            formatted_showtimes += f"    - {time}\n"
+    return formatted_showtimes + "\n"
+
+
+def records_now_playing(payload):
+    return "The TMDb API returned these movies:\n\n" + "".join(
+        movie.render() for movie in parse_movies(payload)[:10]
+    )
+
+
+def records_reviews(payload):
+    return render_reviews(parse_reviews(payload)[0])
+
+
+def records_showtimes(payload):
+    return "".join(["Showtimes:\n\n", parse_theaters(payload)[0].render(), "\n"])
+
+
+def measure(func, payload, iterations):
+    seconds = min(timeit.repeat(lambda: func(payload), number=iterations, repeat=5))
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds / iterations * 1e6, peak / 1024
+
+
+def run(iterations=2000):
+    cases = [
+        ("now playing", make_now_playing(), legacy_now_playing, records_now_playing),
+        ("reviews", make_reviews(), legacy_reviews, records_reviews),
+        ("showtimes", make_showtimes(), legacy_showtimes, records_showtimes),
+    ]
+    print(f"{'payload':<12} {'impl':<8} {'us/call':>9} {'peak KiB':>9}")
+    for name, payload, legacy, records in cases:
+        assert legacy(payload) == records(payload), f"{name} output differs"
+        for impl, func in (("legacy", legacy), ("records", records)):
+            us, kib = measure(func, payload, iterations)
+            print(f"{name:<12} {impl:<8} {us:>9.1f} {kib:>9.1f}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,314 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+BOOKING_DB_PATH = os.getenv("BOOKING_DB_PATH", "bookings.db")
+SEATS_PER_SHOWING = int(os.getenv("SEATS_PER_SHOWING", "100"))
+HOLD_TTL = int(os.getenv("HOLD_TTL_SECONDS", "300"))
+# How long recent bookings stay in memory for retries; older ones are looked up
+# in SQLite by their idempotency key
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS showings (
+    showing_id TEXT PRIMARY KEY,
+    theater TEXT NOT NULL,
+    movie TEXT NOT NULL,
+    showtime TEXT NOT NULL,
+    capacity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    idempotency_key TEXT PRIMARY KEY,
+    booking_id TEXT NOT NULL UNIQUE,
+    showing_id TEXT NOT NULL REFERENCES showings (showing_id),
+    created_at REAL NOT NULL
+);
+"""
+
+
+class BookingError(Exception):
+    pass
+
+
+@dataclass
+class Showing:
+    showing_id: str
+    theater: str
+    movie: str
+    showtime: str
+    capacity: int
+    sold: int = 0
+    holds: set = field(default_factory=set)
+
+    @property
+    def available(self):
+        return self.capacity - self.sold - len(self.holds)
+
+
+@dataclass
+class Hold:
+    hold_id: str
+    showing_id: str
+    expires_at: float
+
+
+@dataclass
+class Booking:
+    booking_id: str
+    idempotency_key: str
+    showing_id: str
+    created_at: float
+
+
+@dataclass
+class _Commit:
+    booking: Booking
+    showing: Showing
+    # The hold the purchase consumed, put back if the commit fails
+    hold: Hold = None
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Exception = None
+
+
+def showing_key(theater, movie, showtime):
+    return "|".join(part.strip().lower() for part in (theater, movie, showtime))
+
+
+class BookingEngine:
+    """Seat inventory per showing, with short-lived holds and atomic purchases.
+
+    The in-memory state, guarded by a single lock, is what decides whether a
+    seat is available, so a seat can never be sold twice. Bookings are then
+    written to SQLite by one writer thread that commits whatever has queued up
+    in a single transaction, and purchase() returns only once its booking is
+    durable. Holds live in memory only; they expire on their own anyway. Only
+    the last IDEMPOTENCY_WINDOW of bookings is kept in memory; a retry of an
+    older purchase is found in SQLite.
+    """
+
+    def __init__(
+        self,
+        path=BOOKING_DB_PATH,
+        seats_per_showing=SEATS_PER_SHOWING,
+        hold_ttl=HOLD_TTL,
+        max_batch=512,
+        idempotency_window=IDEMPOTENCY_WINDOW,
+    ):
+        self.seats_per_showing = seats_per_showing
+        self.hold_ttl = hold_ttl
+        self.max_batch = max_batch
+        self.idempotency_window = idempotency_window
+
+        self._lock = threading.Lock()
+        self._showings = {}
+        self._holds = {}
+        # Idempotency key -> Booking, oldest first
+        self._bookings = OrderedDict()
+        self._pending = {}
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        # Lookups of older bookings, made under self._lock; WAL lets them run
+        # alongside the writer's transactions
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._load()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="booking-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _load(self):
+        for row in self._db.execute(
+            "SELECT showing_id, theater, movie, showtime, capacity FROM showings"
+        ):
+            self._showings[row[0]] = Showing(*row)
+        for showing_id, sold in self._db.execute(
+            "SELECT showing_id, COUNT(*) FROM bookings GROUP BY showing_id"
+        ):
+            self._showings[showing_id].sold = sold
+
+    def _find_booking(self, key):
+        booking = self._bookings.get(key)
+        if booking is None:
+            row = self._reader.execute(
+                "SELECT booking_id, showing_id, created_at FROM bookings "
+                "WHERE idempotency_key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                booking = Booking(row[0], key, row[1], row[2])
+        return booking
+
+    def _remember(self, booking):
+        self._bookings[booking.idempotency_key] = booking
+        cutoff = booking.created_at - self.idempotency_window
+        while True:
+            key, oldest = next(iter(self._bookings.items()))
+            if oldest.created_at >= cutoff or key in self._pending:
+                return
+            del self._bookings[key]
+
+    def _get_showing(self, theater, movie, showtime):
+        showing_id = showing_key(theater, movie, showtime)
+        showing = self._showings.get(showing_id)
+        if showing is None:
+            showing = Showing(
+                showing_id, theater, movie, showtime, self.seats_per_showing
+            )
+            self._showings[showing_id] = showing
+        return showing
+
+    def _expire_holds(self, showing, now):
+        for hold_id in list(showing.holds):
+            if self._holds[hold_id].expires_at <= now:
+                showing.holds.discard(hold_id)
+                del self._holds[hold_id]
+
+    def hold(self, theater, movie, showtime):
+        now = time.monotonic()
+        with self._lock:
+            showing = self._get_showing(theater, movie, showtime)
+            self._expire_holds(showing, now)
+            if showing.available <= 0:
+                raise BookingError(f"{movie} at {theater} for {showtime} is sold out.")
+
+            hold = Hold(uuid.uuid4().hex, showing.showing_id, now + self.hold_ttl)
+            self._holds[hold.hold_id] = hold
+            showing.holds.add(hold.hold_id)
+            return hold
+
+    def release(self, hold_id):
+        with self._lock:
+            hold = self._holds.pop(hold_id, None)
+            if hold is not None:
+                self._showings[hold.showing_id].holds.discard(hold_id)
+
+    def purchase(self, theater, movie, showtime, hold_id=None, idempotency_key=None):
+        # A retried purchase for the same hold is the same purchase
+        retry_key = idempotency_key or hold_id
+        key = retry_key or uuid.uuid4().hex
+        now = time.monotonic()
+
+        with self._lock:
+            booking = self._find_booking(key) if retry_key else None
+            if booking is not None:
+                commit = self._pending.get(key)
+            else:
+                showing = self._get_showing(theater, movie, showtime)
+                self._expire_holds(showing, now)
+
+                hold = None
+                if hold_id is not None:
+                    hold = self._holds.get(hold_id)
+                    if hold is None or hold.showing_id != showing.showing_id:
+                        raise BookingError(
+                            "Your seat hold has expired. Please start the purchase again."
+                        )
+                    del self._holds[hold_id]
+                    showing.holds.discard(hold_id)
+                elif showing.available <= 0:
+                    raise BookingError(
+                        f"{movie} at {theater} for {showtime} is sold out."
+                    )
+
+                showing.sold += 1
+                booking = Booking(
+                    uuid.uuid4().hex[:12].upper(), key, showing.showing_id, time.time()
+                )
+                commit = self._pending[key] = _Commit(booking, showing, hold)
+                self._remember(booking)
+                self._queue.put(commit)
+
+        if commit is not None:
+            commit.done.wait()
+            if commit.error is not None:
+                raise BookingError(f"Could not save booking: {commit.error}")
+        return booking
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            # Everything that queued up while the last batch was being written
+            # goes into one transaction, so one fsync covers many bookings.
+            while len(batch) < self.max_batch:
+                try:
+                    commit = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if commit is None:
+                    self._queue.put(None)
+                    break
+                batch.append(commit)
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO showings VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (s.showing_id, s.theater, s.movie, s.showtime, s.capacity)
+                        for s in {c.showing.showing_id: c.showing for c in batch}.values()
+                    ],
+                )
+                self._db.executemany(
+                    "INSERT INTO bookings VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            c.booking.idempotency_key,
+                            c.booking.booking_id,
+                            c.booking.showing_id,
+                            c.booking.created_at,
+                        )
+                        for c in batch
+                    ],
+                )
+            error = None
+        except sqlite3.Error as e:
+            error = e
+
+        with self._lock:
+            for commit in batch:
+                del self._pending[commit.booking.idempotency_key]
+                if error is not None:
+                    # Give the seat back, to the hold if there was one, so a
+                    # retry with the same hold can still succeed
+                    self._bookings.pop(commit.booking.idempotency_key, None)
+                    commit.showing.sold -= 1
+                    if commit.hold is not None:
+                        self._holds[commit.hold.hold_id] = commit.hold
+                        commit.showing.holds.add(commit.hold.hold_id)
+                commit.error = error
+                commit.done.set()
+
+    def sold(self, theater, movie, showtime):
+        with self._lock:
+            return self._get_showing(theater, movie, showtime).sold
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._reader.close()
+        self._db.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = BookingEngine()
+        return _engine
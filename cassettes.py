@@ -0,0 +1,272 @@
+# Record/replay of upstream HTTP traffic (TMDb, SerpAPI and OpenAI).
+#
+# CASSETTE_MODE=record  passes requests through and appends every response,
+#                       with its original timing, to a gzipped JSON-lines file.
+# CASSETTE_MODE=replay  serves responses from those files without touching the
+#                       network. CASSETTE_LATENCY picks the pacing: "real"
+#                       (default), "0" for none, or a factor such as "0.5".
+#
+# Request headers are never stored and api_key query parameters are dropped
+# from the match key, so cassettes contain no credentials.
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "real").lower()
+
+RECORDING = CASSETTE_MODE == "record"
+REPLAYING = CASSETTE_MODE == "replay"
+
+SECRET_PARAMS = {"api_key"}
+# requests hands us decoded bodies, so these would no longer be true on replay
+DECODED_BODY_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def latency_scale():
+    return 1.0 if CASSETTE_LATENCY == "real" else float(CASSETTE_LATENCY)
+
+
+def request_key(method, url, body=None):
+    parts = urlsplit(url)
+    query = urlencode(
+        sorted((k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS)
+    )
+    key = f"{method} {urlunsplit(parts._replace(query=query))}"
+    if body:
+        if isinstance(body, str):
+            body = body.encode()
+        key += f" {hashlib.sha1(body).hexdigest()}"
+    return key
+
+
+class Cassette:
+    def __init__(self, name, directory=CASSETTE_DIR):
+        self.path = os.path.join(directory, f"{name}.jsonl.gz")
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        if REPLAYING and os.path.exists(self.path):
+            with gzip.open(self.path, "rt") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+
+    def record(self, entry):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Each append is its own gzip member; gzip.open reads them back as one
+            with gzip.open(self.path, "at") as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def play(self, key):
+        # Identical requests are served in recorded order; the last recording
+        # keeps being reused once the others have been played.
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+
+def make_entry(key, status, reason, headers, elapsed, chunks):
+    return {
+        "key": key,
+        "status": status,
+        "reason": reason,
+        "headers": headers,
+        "elapsed": round(elapsed, 4),
+        "chunks": [
+            [round(offset, 4), base64.b64encode(chunk).decode()]
+            for offset, chunk in chunks
+        ],
+    }
+
+
+def iter_chunks(entry):
+    # Yields (seconds to wait, chunk), relative to the previous chunk
+    previous = entry["elapsed"]
+    for offset, chunk in entry["chunks"]:
+        yield max(offset - previous, 0.0), base64.b64decode(chunk)
+        previous = offset
+
+
+class CassetteAdapter(HTTPAdapter):
+    """requests transport adapter that records to or replays from a cassette."""
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        if REPLAYING:
+            return self._replay(request, key)
+
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        body = response.content
+        headers = [
+            [k, v]
+            for k, v in response.headers.items()
+            if k.lower() not in DECODED_BODY_HEADERS
+        ]
+        self.cassette.record(
+            make_entry(
+                key,
+                response.status_code,
+                response.reason,
+                headers,
+                response.elapsed.total_seconds(),
+                [(time.perf_counter() - start, body)],
+            )
+        )
+        return response
+
+    def _replay(self, request, key):
+        entry = self.cassette.play(key)
+        if entry is None:
+            raise requests.ConnectionError(f"No recorded response for {key}")
+
+        scale = latency_scale()
+        time.sleep(entry["elapsed"] * scale)
+        body = b""
+        for delay, chunk in iter_chunks(entry):
+            time.sleep(delay * scale)
+            body += chunk
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=entry["elapsed"])
+        response.url = request.url
+        response.request = request
+        response._content = body
+        return response
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    def __init__(self, response, on_close):
+        self._response = response
+        self._on_close = on_close
+        self._start = time.perf_counter()
+        self._chunks = []
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._response.stream:
+            self._chunks.append((time.perf_counter() - self._start, chunk))
+            yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        await self._response.aclose()
+        self._on_close(self._chunks, self._start)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, entry, scale):
+        self._entry = entry
+        self._scale = scale
+
+    async def __aiter__(self):
+        for delay, chunk in iter_chunks(self._entry):
+            if delay and self._scale:
+                await asyncio.sleep(delay * self._scale)
+            yield chunk
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """httpx transport that records to or replays from a cassette.
+
+    Streamed responses, such as OpenAI chat completions, keep the timing of
+    every chunk, so a replay shows the same time-to-first-token as the
+    original call.
+    """
+
+    def __init__(self, cassette, transport=None):
+        self.cassette = cassette
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        key = request_key(request.method, str(request.url), await request.aread())
+        if REPLAYING:
+            entry = self.cassette.play(key)
+            if entry is None:
+                raise httpx.ConnectError(
+                    f"No recorded response for {key}", request=request
+                )
+            scale = latency_scale()
+            if scale:
+                await asyncio.sleep(entry["elapsed"] * scale)
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_ReplayStream(entry, scale),
+                request=request,
+            )
+
+        start = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        elapsed = time.perf_counter() - start
+        headers = [[k, v] for k, v in response.headers.multi_items()]
+
+        def on_close(chunks, stream_start):
+            offset = stream_start - start
+            self.cassette.record(
+                make_entry(
+                    key,
+                    response.status_code,
+                    response.extensions.get("reason_phrase", b"").decode(),
+                    headers,
+                    elapsed,
+                    [(offset + t, chunk) for t, chunk in chunks],
+                )
+            )
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response, on_close),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def install(session, name="http"):
+    # Mounts the cassette on a requests.Session; a no-op unless CASSETTE_MODE is set
+    if RECORDING or REPLAYING:
+        session.mount("https://", CassetteAdapter(Cassette(name)))
+    return session
+
+
+def openai_http_client(name="openai"):
+    # An http_client for AsyncOpenAI, or None to let it build its default one
+    if not (RECORDING or REPLAYING):
+        return None
+
+    from openai import DefaultAsyncHttpxClient
+
+    return DefaultAsyncHttpxClient(transport=CassetteTransport(Cassette(name)))
@@ -0,0 +1,633 @@
+# Shared engine for the milestone apps.
+# Every milestone is a ChatConfig on top of this module: one OpenAI client per
+# worker, one completion/parsing path, and one registry through which every
+# tool call is dispatched, cached and rate limited.
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import chainlit as cl
+from dotenv import load_dotenv
+from langfuse.decorators import observe
+from langfuse.openai import AsyncOpenAI
+
+import cassettes
+import warmup
+
+load_dotenv()
+
+DEFAULT_GEN_KWARGS = {"model": "gpt-4o-mini", "temperature": 0.2, "max_tokens": 500}
+FUNCTION_CALL_OPEN = "[FUNCTION_CALL]"
+
+# How many calls of each concurrency class may run at once per worker. Each
+# class has its own thread pool of that size, so a call that timed out keeps
+# its slot until its thread is done, and one class can't starve another.
+# "inline" tools are cheap and run directly on the event loop.
+CONCURRENCY_LIMITS = {"network": 16, "booking": 64}
+
+# Turns of routing records kept per chat session
+ROUTING_LOG_MAX_TURNS = 50
+
+# Results of tools with a cache_ttl, shared by every chat in the worker
+TOOL_CACHE_MAX_ENTRIES = 512
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(http_client=cassettes.openai_http_client())
+    return _client
+
+
+@dataclass
+class Tool:
+    name: str
+    func: callable
+    params: tuple
+    description: str
+    cache_ttl: float = 0
+    timeout: float = 30
+    concurrency: str = "network"
+    # Generator variant whose pieces can be streamed to the user, the extra
+    # kwargs to call it with, and how many pieces are enough to start the
+    # follow-up generation.
+    stream: callable = None
+    stream_kwargs: dict = field(default_factory=dict)
+    stream_ready: int = 1
+    # How many streamed pieces go into the history; the rest are only shown to
+    # the user. None keeps them all.
+    history_limit: int = None
+
+    def signature(self, typed=False):
+        params = (f"{param}: str" for param in self.params) if typed else self.params
+        return f"{self.name}({', '.join(params)})"
+
+
+TOOLS = {}
+_tool_cache = OrderedDict()
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def register_tool(func, params, description, name=None, **policy):
+    tool = Tool(name or func.__name__, func, tuple(params), description, **policy)
+    TOOLS[tool.name] = tool
+    return func
+
+
+def tool(params, description, **policy):
+    def decorator(func):
+        return register_tool(func, params, description, **policy)
+
+    return decorator
+
+
+def describe_tools(names, typed=False):
+    # The "Available functions" list for a system prompt
+    return "\n".join(
+        f"- {TOOLS[name].signature(typed)}: {TOOLS[name].description}"
+        for name in names
+    )
+
+
+def cached_result(key):
+    entry = _tool_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del _tool_cache[key]
+        return None
+    _tool_cache.move_to_end(key)
+    return entry[1]
+
+
+def cache_result(key, ttl, result):
+    now = time.monotonic()
+    expired = [k for k, (expires_at, _) in _tool_cache.items() if expires_at <= now]
+    for k in expired:
+        del _tool_cache[k]
+    _tool_cache[key] = (now + ttl, result)
+    _tool_cache.move_to_end(key)
+    # Least recently used first
+    while len(_tool_cache) > TOOL_CACHE_MAX_ENTRIES:
+        _tool_cache.popitem(last=False)
+
+
+def tool_arguments(tool, parameters):
+    # The JSON protocol passes parameters by name, the bracket one by position
+    if isinstance(parameters, dict):
+        return [parameters.get(param) for param in tool.params]
+    return list(parameters)
+
+
+def executor_for(concurrency):
+    with _executors_lock:
+        executor = _executors.get(concurrency)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                CONCURRENCY_LIMITS[concurrency], thread_name_prefix=concurrency
+            )
+            _executors[concurrency] = executor
+        return executor
+
+
+def tool_error(tool, e):
+    if isinstance(e, asyncio.TimeoutError):
+        return f"Error: {tool.name} timed out after {tool.timeout} seconds"
+    return f"Error: {str(e)}"
+
+
+@observe
+async def call_tool(name, parameters):
+    tool = TOOLS.get(name)
+    if tool is None:
+        return f"Error: Unknown function {name}"
+
+    args = tool_arguments(tool, parameters)
+    cache_key = (name, tuple(args))
+    if tool.cache_ttl and (cached := cached_result(cache_key)) is not None:
+        return cached
+
+    try:
+        if tool.concurrency == "inline":
+            result = tool.func(*args)
+        else:
+            # Like stream_tool_call(), the timeout includes waiting for a thread
+            loop = asyncio.get_running_loop()
+            result = await asyncio.wait_for(
+                loop.run_in_executor(
+                    executor_for(tool.concurrency), tool.func, *args
+                ),
+                tool.timeout,
+            )
+    except Exception as e:
+        return tool_error(tool, e)
+
+    if tool.cache_ttl and not result.startswith("Error"):
+        cache_result(cache_key, tool.cache_ttl, result)
+    return result
+
+
+def function_result_message(name, result):
+    return {
+        "role": "system",
+        "content": f"Function {name} returned: {json.dumps(result)}",
+    }
+
+
+def format_parameters(parameters):
+    if isinstance(parameters, dict):
+        return ", ".join(f"{k}={v}" for k, v in parameters.items())
+    return ", ".join(parameters)
+
+
+def parse_function_call(full_response):
+    function_call_match = re.search(
+        r"\[FUNCTION_CALL\](.*?)\[/FUNCTION_CALL\]", full_response, re.DOTALL
+    )
+    if not function_call_match:
+        return None
+    function_call = function_call_match.group(1).strip()
+    function_name, params_str = function_call.split("(", 1)
+    params_str = params_str.rstrip(")")
+    params = [param.strip() for param in params_str.split(",") if param.strip()]
+    return {"function": function_name, "parameters": params}
+
+
+def parse_json_function_call(full_response):
+    try:
+        function_call = json.loads(full_response)
+    except json.JSONDecodeError as e:
+        print(f"Debug - JSON parsing error: {e}")
+        print(f"Debug - Full response: {full_response}")
+        return None
+    if isinstance(function_call, dict) and "function" in function_call:
+        return {
+            "function": function_call["function"],
+            "parameters": function_call.get("parameters", {}),
+        }
+    return None
+
+
+@dataclass
+class ChatConfig:
+    system_prompt: str
+    gen_kwargs: dict = field(default_factory=lambda: dict(DEFAULT_GEN_KWARGS))
+    parse_function_call: callable = parse_function_call
+    # Function calls allowed per user message; None for no limit
+    max_function_calls: int = None
+    # Report tool errors to the user instead of passing them to the model
+    stop_on_error: bool = True
+    # Small model for function-call turns; requires the [FUNCTION_CALL] format
+    router_kwargs: dict = None
+    # Price of a router token relative to a main-model token, for reporting
+    router_cost_ratio: float = 1.0
+    # Stream tools that have a stream variant to the user (see stream_tool_call)
+    stream_tools: bool = False
+
+    # Hooks for apps that need more than the generic turn:
+    # before_turn(content, message_history), async, runs once the user message
+    #   is in the history; returning True means it answered the message itself.
+    # before_generate(message_history) runs before every generation, e.g. to
+    #   update the system prompt.
+    # before_tool and after_tool map a tool name to a hook for its calls:
+    #   before_tool[name](parameters) runs before the tool, and the async
+    #   after_tool[name](parameters, result) once it has returned; returning True
+    #   from the latter ends the turn without a reply from the model.
+    # after_answer(content, tools_used, messages), async, runs once the answer is
+    #   in the history; messages are the ones the turn added after the user's.
+    before_turn: callable = None
+    before_generate: callable = None
+    before_tool: dict = field(default_factory=dict)
+    after_tool: dict = field(default_factory=dict)
+    after_answer: callable = None
+
+
+async def stream_completion(
+    client, message_history, kwargs, function_calls_only=False
+):
+    # Returns (text, usage, seconds, streamed), where streamed counts the
+    # content chunks received (about one token each). With function_calls_only,
+    # the stream is abandoned as soon as the reply can't be a function call;
+    # text is then None, and so is usage, which only arrives with the last chunk.
+    start = time.perf_counter()
+    full_response = ""
+    usage = None
+    streamed = 0
+    stream = await client.chat.completions.create(
+        messages=message_history,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+    async for part in stream:
+        # The usage chunk arrives last and carries no choices
+        if part.usage:
+            usage = part.usage
+        if part.choices and (token := part.choices[0].delta.content or ""):
+            full_response += token
+            streamed += 1
+            stripped = full_response.lstrip()
+            if function_calls_only and not (
+                stripped.startswith(FUNCTION_CALL_OPEN)
+                or FUNCTION_CALL_OPEN.startswith(stripped)
+            ):
+                await stream.close()
+                return None, usage, time.perf_counter() - start, streamed
+
+    if usage:
+        details = usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details else 0
+        print(
+            f"[{kwargs['model']}] Prompt tokens: {usage.prompt_tokens} "
+            f"(cached: {cached_tokens}), completion tokens: {usage.completion_tokens}"
+        )
+    return full_response, usage, time.perf_counter() - start, streamed
+
+
+def routing_record(kwargs, usage, seconds, outcome):
+    return {
+        "model": kwargs["model"],
+        "outcome": outcome,
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "completion_tokens": usage.completion_tokens if usage else None,
+        "seconds": round(seconds, 3),
+    }
+
+
+@observe
+async def generate_response(client, message_history, config):
+    routing = []
+    router_kwargs = config.router_kwargs
+
+    handoff = None
+    if router_kwargs and router_kwargs["model"] != config.gen_kwargs["model"]:
+        full_response, usage, seconds, streamed = await stream_completion(
+            client, message_history, router_kwargs, function_calls_only=True
+        )
+        function_call = full_response and config.parse_function_call(full_response)
+        record = routing_record(
+            router_kwargs,
+            usage,
+            seconds,
+            "function_call" if function_call else "handed_off",
+        )
+        routing.append(record)
+        if not function_call:
+            handoff = record
+            if record["completion_tokens"] is None:
+                record["completion_tokens"] = streamed
+        if function_call:
+            return {
+                "type": "function_call",
+                "content": function_call,
+                "text": full_response,
+                "routing": routing,
+            }
+
+    full_response, usage, seconds, _ = await stream_completion(
+        client, message_history, config.gen_kwargs
+    )
+    if handoff and handoff["prompt_tokens"] is None and usage:
+        # The abandoned router stream never reported usage; its prompt was the
+        # same history the main model just read
+        handoff["prompt_tokens"] = usage.prompt_tokens
+
+    # Check if the response contains a function call
+    function_call = config.parse_function_call(full_response)
+    routing.append(
+        routing_record(
+            config.gen_kwargs,
+            usage,
+            seconds,
+            "function_call" if function_call else "message",
+        )
+    )
+    if function_call:
+        return {
+            "type": "function_call",
+            "content": function_call,
+            "text": full_response,
+            "routing": routing,
+        }
+
+    # If no function call is detected, return the full response as a message
+    return {
+        "type": "message",
+        "content": full_response,
+        "text": full_response,
+        "routing": routing,
+    }
+
+
+def report_routing(routing, config):
+    router_kwargs = config.router_kwargs
+    if (
+        not routing
+        or not router_kwargs
+        or router_kwargs["model"] == config.gen_kwargs["model"]
+    ):
+        # Routing is off when both name the same model
+        return
+    # A function call the router made is one the main model would otherwise
+    # have made, over the same prompt. Against that, every router call costs
+    # its own tokens, and a handoff also delays the main model's answer.
+    main_model = config.gen_kwargs["model"]
+    routed = [r for r in routing if r["model"] != main_model]
+    handoffs = [r for r in routed if r["outcome"] == "handed_off"]
+
+    def tokens(record):
+        return (record["prompt_tokens"] or 0) + (record["completion_tokens"] or 0)
+
+    avoided = sum(tokens(r) for r in routed if r["outcome"] == "function_call")
+    overhead = config.router_cost_ratio * sum(tokens(r) for r in routed)
+    net = avoided - overhead
+    handoff_seconds = sum(r["seconds"] for r in handoffs)
+    print(
+        f"Routing: {len(routing)} calls, {len(routed)} to "
+        f"{router_kwargs['model']}, net {net:+.0f} {main_model}-equivalent "
+        f"tokens ({avoided} avoided, {overhead:.0f} router overhead), "
+        f"{handoff_seconds:.2f}s added by {len(handoffs)} handoffs"
+    )
+    turns = cl.user_session.get("routing_log", [])[-(ROUTING_LOG_MAX_TURNS - 1) :]
+    turns.append(
+        {
+            "calls": routing,
+            "main_tokens_avoided": avoided,
+            "router_overhead": round(overhead, 1),
+            "net_tokens_saved": round(net, 1),
+            "handoff_seconds": round(handoff_seconds, 3),
+        }
+    )
+    cl.user_session.set("routing_log", turns)
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+async def iterate_in_executor(executor, make_iterator):
+    # The tools use blocking HTTP calls, so the whole iteration runs in one
+    # thread of the executor, which stays taken until the iterator is done or
+    # stops at the next piece after the consumer went away.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def run():
+        try:
+            for chunk in make_iterator():
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, _Failure(e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(executor, run)
+    try:
+        while (chunk := await queue.get()) is not done:
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            yield chunk
+    finally:
+        stop.set()
+
+
+@observe
+async def stream_tool_call(name, parameters, message_history, config):
+    """Streams a tool's output to the user and starts the follow-up early.
+
+    Once tool.stream_ready pieces have arrived, the partial result is added to
+    the history and the next generation starts while the rest keeps
+    streaming. The history entry is completed, up to tool.history_limit
+    pieces, when the tool finishes. The tool runs under the same concurrency
+    pool, timeout and cache as call_tool(). Returns {"type": "error", ...} or
+    {"type": "result", "content": response, "result": result}, where response
+    is None if the tool finished before the follow-up was started and result is
+    what the history holds.
+    """
+    tool = TOOLS[name]
+    args = tool_arguments(tool, parameters)
+    # The streamed pieces are cached, not call_tool()'s result, which may be
+    # shorter (e.g. one page of reviews instead of three)
+    cache_key = (name, tuple(args), "stream")
+    tool_message = cl.Message(content="")
+    chunks = []
+    ready = asyncio.Event()
+
+    def history_result():
+        kept = chunks[: tool.history_limit]
+        result = "".join(kept)
+        if len(kept) < len(chunks):
+            result += f"\n({len(chunks) - len(kept)} more shown to the user)"
+        return result
+
+    if tool.cache_ttl and (cached := cached_result(cache_key)) is not None:
+        chunks.extend(cached)
+        await cl.Message(content="".join(chunks)).send()
+        message_history.append(function_result_message(name, history_result()))
+        return {"type": "result", "content": None, "result": history_result()}
+
+    async def stream():
+        pieces = iterate_in_executor(
+            executor_for(tool.concurrency),
+            lambda: tool.stream(*args, **tool.stream_kwargs),
+        )
+        async for chunk in pieces:
+            chunks.append(chunk)
+            await tool_message.stream_token(chunk)
+            if len(chunks) >= tool.stream_ready:
+                ready.set()
+
+    async def pump():
+        try:
+            await asyncio.wait_for(stream(), tool.timeout)
+        finally:
+            ready.set()
+            if chunks:
+                await tool_message.send()
+
+    pump_task = asyncio.create_task(pump())
+    await ready.wait()
+
+    if pump_task.done() and (error := pump_task.exception()):
+        if not chunks:
+            return {"type": "error", "content": tool_error(tool, error)}
+        print(f"Debug - {name} stopped early: {tool_error(tool, error)}")
+
+    result_message = function_result_message(name, history_result())
+    message_history.append(result_message)
+
+    response = None
+    if not pump_task.done():
+        result_message["content"] += (
+            " (first results only; the full list is being shown to the user)"
+        )
+        try:
+            if config.before_generate:
+                config.before_generate(message_history)
+            response = await generate_response(get_client(), message_history, config)
+        except BaseException:
+            # Don't keep streaming into a turn that has already failed
+            pump_task.cancel()
+            await asyncio.gather(pump_task, return_exceptions=True)
+            raise
+
+    try:
+        await pump_task
+    except Exception as e:
+        print(f"Debug - {name} stopped early: {tool_error(tool, e)}")
+    else:
+        if tool.cache_ttl and chunks and not chunks[0].startswith("Error"):
+            cache_result(cache_key, tool.cache_ttl, tuple(chunks))
+    result_message.update(function_result_message(name, history_result()))
+    return {"type": "result", "content": response, "result": history_result()}
+
+
+def start_chat(config):
+    warmup.start_openai_warm_up(get_client())
+    message_history = [{"role": "system", "content": config.system_prompt}]
+    cl.user_session.set("message_history", message_history)
+    return message_history
+
+
+async def run_turn(config, content):
+    # The generic turn: generate, run any function calls, answer the user
+    message_history = cl.user_session.get("message_history", [])
+    message_history.append({"role": "user", "content": content})
+    cl.user_session.set("message_history", message_history)
+    if config.before_turn and await config.before_turn(content, message_history):
+        return
+
+    client = get_client()
+    turn_start = len(message_history)
+    function_calls = 0
+    tools_used = []
+    routing = []
+    # A follow-up that stream_tool_call() already generated
+    pending_response = None
+
+    try:
+        while True:
+            if pending_response is None:
+                if config.before_generate:
+                    config.before_generate(message_history)
+                response = await generate_response(client, message_history, config)
+            else:
+                response, pending_response = pending_response, None
+            routing.extend(response["routing"])
+            if response["type"] != "function_call" or (
+                config.max_function_calls is not None
+                and function_calls >= config.max_function_calls
+            ):
+                break
+            function_calls += 1
+
+            function_name = response["content"]["function"]
+            function_params = response["content"]["parameters"]
+
+            # Display the function call
+            param_str = format_parameters(function_params)
+            await cl.Message(
+                content=f"Calling function: {function_name}({param_str})"
+            ).send()
+
+            tools_used.append(function_name)
+            if hook := config.before_tool.get(function_name):
+                hook(function_params)
+
+            # Execute the function
+            tool = TOOLS.get(function_name)
+            if config.stream_tools and tool and tool.stream:
+                streamed = await stream_tool_call(
+                    function_name, function_params, message_history, config
+                )
+                function_result = streamed.get("result", streamed["content"])
+            else:
+                streamed = None
+                function_result = await call_tool(function_name, function_params)
+
+            # If the function result is an error, send it to the user
+            if config.stop_on_error and function_result.startswith("Error:"):
+                await cl.Message(
+                    content=f"An error occurred: {function_result}"
+                ).send()
+                return
+
+            hook = config.after_tool.get(function_name)
+            if hook and await hook(function_params, function_result):
+                return
+
+            if streamed and streamed["type"] == "result":
+                # Already in the history; None if the follow-up wasn't started
+                pending_response = streamed["content"]
+                continue
+
+            # Add the result to the message history as a system message
+            message_history.append(
+                function_result_message(function_name, function_result)
+            )
+
+        # Add the assistant's response to the message history
+        message_history.append({"role": "assistant", "content": response["text"]})
+        if config.after_answer:
+            await config.after_answer(
+                response["text"], tools_used, message_history[turn_start:]
+            )
+
+        # Send the response to the user
+        await cl.Message(content=response["text"]).send()
+    finally:
+        report_routing(routing, config)
@@ -18,9 +18,9 @@ load_dotenv()
 # client = wrap_openai(openai.AsyncClient())
 
 from langfuse.decorators import observe
-from langfuse.openai import AsyncOpenAI
- 
-client = AsyncOpenAI()
+from core import get_client
+
+client = get_client()
 
 gen_kwargs = {
     "model": "gpt-4o",
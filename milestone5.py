@@ -8,25 +8,45 @@
 ######
 # Code
 
-from dotenv import load_dotenv
+import asyncio
 import chainlit as cl
 from langfuse.decorators import observe
-from langfuse.openai import AsyncOpenAI
-import json
+import os
 import re
-from movie_functions import (
-    get_now_playing_movies,
-    get_showtimes,
-    buy_ticket,
-    get_reviews,
-)
+import response_cache
+import tools  # noqa: F401 (registers the movie tools)
+import warmup
+from booking import get_engine
+from core import ChatConfig, call_tool, describe_tools, run_turn, start_chat, tool
+
+
+# Connect to the upstream APIs in the background while the app starts
+warmup.start_warm_up()
 
-load_dotenv()
 
-client = AsyncOpenAI()
+# Defined before SYSTEM_PROMPT, which lists the registered tools
+@tool(
+    params=("theater", "movie", "showtime"),
+    description="Initiates the ticket purchase process and returns a confirmation message.",
+    # Runs on the event loop so it can use the chat session
+    concurrency="inline",
+)
+def confirm_ticket_purchase(theater, movie, showtime):
+    # Hold a seat while the user confirms so it can't be sold in the meantime
+    engine = get_engine()
+    hold = engine.hold(theater, movie, showtime)
+    cl.user_session.set("hold_id", hold.hold_id)
+    ttl = engine.hold_ttl
+    if ttl < 60 or ttl % 60:
+        held_for = f"{ttl} seconds"
+    else:
+        held_for = f"{ttl // 60} minute{'s' if ttl >= 120 else ''}"
+    confirmation_message = f"You're about to purchase a ticket for '{movie}' at {theater} for {showtime}. Your seat is held for {held_for}. Please type BUY to confirm or any other message to cancel."
+    return confirmation_message
+
 
-gen_kwargs = {"model": "gpt-4o-mini", "temperature": 0.2, "max_tokens": 500}
-SYSTEM_PROMPT = """\
+SYSTEM_PROMPT = (
+    """\
 You are a helpful AI assistant for a movie information and ticket booking service. Your role is to assist users with finding movie information, showtimes, and booking tickets. Always be polite and professional.
 
 IMPORTANT: When a function call is needed, ALWAYS respond in the following format:
@@ -40,24 +60,39 @@ When users ask about movie showtimes:
 5. Recognize common abbreviations or nicknames for cities (e.g., "SF" or "san fran" for San Francisco).
 
 Available functions:
-- get_now_playing_movies(): Returns a list of movies currently playing in theaters.
-- get_showtimes(title, location): Returns showtimes for a specific movie in a given location.
-- confirm_ticket_purchase(theater, movie, showtime): Initiates the ticket purchase process and returns a confirmation message.
-- get_reviews(movie_id): Returns reviews for a specific movie.
-
-IMPORTANT: When a user wants to buy a ticket, ALWAYS call confirm_ticket_purchase first. NEVER call buy_ticket directly.
-
-The buying process should follow these steps:
-1. Call confirm_ticket_purchase with the theater, movie, and showtime.
-2. Wait for the user's confirmation (they will type "BUY" to confirm).
-3. The system will handle the actual purchase if the user confirms.
+"""
+    + describe_tools(
+        [
+            "get_now_playing_movies",
+            "get_showtimes",
+            "confirm_ticket_purchase",
+            "get_reviews",
+            "recommend_similar",
+        ]
+    )
+    + """
 
 For all other responses that don't require a function call, respond normally to the user's query.
 
 Remember: ALWAYS use the [FUNCTION_CALL] format for function calls, and ONLY use it for function calls.
 
 If a function call returns an error or no results, respond to the user with an appropriate message explaining the issue and suggesting alternatives if possible.
+"""
+)
 
+# Optional prompt sections, appended after SYSTEM_PROMPT in the order they
+# become relevant. SYSTEM_PROMPT itself never changes, so the prefix stays
+# byte-identical across calls and provider-side prompt caching keeps hitting.
+PROMPT_SECTIONS = {
+    "purchase": """
+IMPORTANT: When a user wants to buy a ticket, ALWAYS call confirm_ticket_purchase first. NEVER call buy_ticket directly.
+
+The buying process should follow these steps:
+1. Call confirm_ticket_purchase with the theater, movie, and showtime.
+2. Wait for the user's confirmation (they will type "BUY" to confirm).
+3. The system will handle the actual purchase if the user confirms.
+""",
+    "table": """
 When displaying the list of now playing movies, present the information in a table format with the following columns:
 - Title
 - Release Date
@@ -71,141 +106,149 @@ Use Markdown syntax to create the table. For example:
 | Movie 2 | 2023-05-15 | Another exciting movie description... |
 
 Ensure that the table is properly formatted and easy to read.
-"""
+""",
+}
 
+BOOKING_PATTERN = re.compile(r"\b(buy|book|booking|purchase|tickets?)\b", re.IGNORECASE)
 
-@observe
-@cl.on_chat_start
-def on_chat_start():
-    message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
-    cl.user_session.set("message_history", message_history)
 
+def build_system_prompt(sections):
+    return SYSTEM_PROMPT + "".join(PROMPT_SECTIONS[name] for name in sections)
 
-@observe
-async def generate_response(client, message_history, gen_kwargs):
-    full_response = ""
-    async for part in await client.chat.completions.create(
-        messages=message_history, stream=True, **gen_kwargs
-    ):
-        if token := part.choices[0].delta.content or "":
-            full_response += token
-
-    # Check if the response contains a function call
-    function_call_match = re.search(
-        r"\[FUNCTION_CALL\](.*?)\[/FUNCTION_CALL\]", full_response, re.DOTALL
-    )
-    if function_call_match:
-        function_call = function_call_match.group(1).strip()
-        function_name, params_str = function_call.split("(", 1)
-        params_str = params_str.rstrip(")")
-        params = [param.strip() for param in params_str.split(",") if param.strip()]
-        return {
-            "type": "function_call",
-            "content": {"function": function_name, "parameters": params},
-        }
 
-    # If no function call is detected, return the full response as a message
-    return {"type": "message", "content": full_response}
+def add_prompt_section(name):
+    # Sections are sticky and kept in the order they were added: once added
+    # they stay, so the prompt only grows at the end and everything before it
+    # remains cacheable.
+    sections = cl.user_session.get("prompt_sections", [])
+    if name not in sections:
+        sections.append(name)
+    cl.user_session.set("prompt_sections", sections)
 
 
-@observe
-async def handle_function_call(function_call):
-    function_name = function_call.get("function")
-    parameters = function_call.get("parameters", [])
-
-    try:
-        if function_name == "get_now_playing_movies":
-            return get_now_playing_movies()
-        elif function_name == "get_showtimes":
-            return get_showtimes(*parameters)
-        elif function_name == "buy_ticket":
-            return buy_ticket(*parameters)
-        elif function_name == "get_reviews":
-            return get_reviews(*parameters)
-        elif function_name == "confirm_ticket_purchase":
-            return confirm_ticket_purchase(*parameters)
-        else:
-            return f"Error: Unknown function {function_name}"
-    except Exception as e:
-        return f"Error: {str(e)}"
+def update_system_prompt(message_history):
+    sections = cl.user_session.get("prompt_sections", [])
+    message_history[0]["content"] = build_system_prompt(sections)
 
 
-@cl.on_message
-@observe
-async def on_message(message: cl.Message):
-    message_history = cl.user_session.get("message_history", [])
-    message_history.append({"role": "user", "content": message.content})
+async def before_turn(content, message_history):
+    if BOOKING_PATTERN.search(content):
+        add_prompt_section("purchase")
 
     # Check if we're waiting for a purchase confirmation
-    awaiting_confirmation = cl.user_session.get("awaiting_confirmation", False)
-    if awaiting_confirmation:
-        if message.content.lower() == "buy":
-            # Proceed with the purchase
-            purchase_details = cl.user_session.get("purchase_details")
-            result = await handle_function_call(
-                {"function": "buy_ticket", "parameters": purchase_details}
-            )
-            await cl.Message(content=f"Ticket purchased successfully: {result}").send()
+    if cl.user_session.get("awaiting_confirmation", False):
+        await finish_purchase(content)
+        return True
+
+    # First-turn questions are context-independent and may be answered from cache
+    cl.user_session.set("response_cache_key", None)
+    if not response_cache.is_first_turn(message_history):
+        return False
+    cached = await asyncio.to_thread(response_cache.lookup, content)
+    if cached is None:
+        cl.user_session.set("response_cache_key", content)
+        return False
+
+    message_history.extend(dict(m) for m in cached["messages"])
+    for name in cached["prompt_sections"]:
+        add_prompt_section(name)
+    update_system_prompt(message_history)
+    await stream_cached_answer(cached["answer"])
+    return True
+
+
+async def finish_purchase(content):
+    hold_id = cl.user_session.get("hold_id")
+    if content.lower() == "buy":
+        # Proceed with the purchase; the hold doubles as the idempotency key
+        purchase_details = cl.user_session.get("purchase_details")
+        result = await call_tool("buy_ticket", [*purchase_details, hold_id])
+        if result.startswith("Error:"):
+            await cl.Message(content=f"An error occurred: {result}").send()
         else:
-            await cl.Message(content="Purchase cancelled.").send()
-
-        # Reset the confirmation state
-        cl.user_session.set("awaiting_confirmation", False)
-        cl.user_session.set("purchase_details", None)
-        return
-
-    while True:
-        response = await generate_response(client, message_history, gen_kwargs)
-
-        if response["type"] == "function_call":
-            function_name = response["content"].get("function")
-            function_params = response["content"].get("parameters", [])
-
-            # Display the function call
-            param_str = ", ".join(function_params)
-            await cl.Message(
-                content=f"Calling function: {function_name}({param_str})"
-            ).send()
-
-            # Execute the function
-            function_result = await handle_function_call(response["content"])
-
-            # If the function result is an error, send it to the user
-            if isinstance(function_result, str) and function_result.startswith(
-                "Error:"
-            ):
-                await cl.Message(content=f"An error occurred: {function_result}").send()
-                return
-
-            # Handle confirm_ticket_purchase separately
-            if function_name == "confirm_ticket_purchase":
-                cl.user_session.set("awaiting_confirmation", True)
-                cl.user_session.set("purchase_details", function_params)
-                await cl.Message(content=function_result).send()
-                return
-
-            # Add the result to the message history as a system message
-            message_history.append(
-                {
-                    "role": "system",
-                    "content": f"Function {function_name} returned: {json.dumps(function_result)}",
-                }
-            )
-
-            # Generate a new response based on the function result
-            continue
-        else:
-            # Add the assistant's response to the message history
-            message_history.append(
-                {"role": "assistant", "content": response["content"]}
-            )
-            cl.user_session.set("message_history", message_history)
+            await cl.Message(content=f"Ticket purchased successfully: {result}").send()
+    else:
+        get_engine().release(hold_id)
+        await cl.Message(content="Purchase cancelled.").send()
+
+    # Reset the confirmation state
+    cl.user_session.set("awaiting_confirmation", False)
+    cl.user_session.set("purchase_details", None)
+    cl.user_session.set("hold_id", None)
+
+
+def expect_booking(parameters):
+    # Showtimes lead to bookings; add the rules before the follow-up
+    # generation starts
+    add_prompt_section("purchase")
+
+
+async def await_confirmation(parameters, result):
+    cl.user_session.set("awaiting_confirmation", True)
+    cl.user_session.set("purchase_details", parameters)
+    await cl.Message(content=result).send()
+    return True
+
+
+async def show_as_table(parameters, result):
+    # Now-playing data is in the history, so the model needs the table rules
+    add_prompt_section("table")
+
+
+async def cache_answer(content, tools_used, messages):
+    if cache_key := cl.user_session.get("response_cache_key"):
+        await asyncio.to_thread(
+            response_cache.store,
+            cache_key,
+            tools_used,
+            messages,
+            cl.user_session.get("prompt_sections", []),
+        )
+
+
+async def stream_cached_answer(answer):
+    response_message = cl.Message(content="")
+    for line in answer.splitlines(keepends=True):
+        await response_message.stream_token(line)
+    await response_message.send()
+
+
+config = ChatConfig(
+    system_prompt=SYSTEM_PROMPT,
+    gen_kwargs={
+        "model": os.getenv("MAIN_MODEL", "gpt-4o-mini"),
+        "temperature": 0.2,
+        "max_tokens": 500,
+    },
+    # Deciding whether a turn is a function call, and extracting its arguments,
+    # takes a few tokens from a small model. Only final answers go to the main
+    # model. Routing is skipped when both name the same model.
+    router_kwargs={
+        "model": os.getenv("ROUTER_MODEL", "gpt-4o-mini"),
+        "temperature": 0,
+        "max_tokens": 60,
+    },
+    router_cost_ratio=float(os.getenv("ROUTER_COST_RATIO", "1.0")),
+    stream_tools=True,
+    before_turn=before_turn,
+    before_generate=update_system_prompt,
+    before_tool={"get_showtimes": expect_booking},
+    after_tool={
+        "confirm_ticket_purchase": await_confirmation,
+        "get_now_playing_movies": show_as_table,
+    },
+    after_answer=cache_answer,
+)
 
-            # Send the response to the user
-            await cl.Message(content=response["content"]).send()
-            break
 
+@observe
+@cl.on_chat_start
+async def on_chat_start():
+    start_chat(config)
+    cl.user_session.set("prompt_sections", [])
 
-def confirm_ticket_purchase(theater, movie, showtime):
-    confirmation_message = f"You're about to purchase a ticket for '{movie}' at {theater} for {showtime}. Please type BUY to confirm or any other message to cancel."
-    return confirmation_message
+
+@cl.on_message
+@observe
+async def on_message(message: cl.Message):
+    await run_turn(config, message.content)
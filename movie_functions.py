@@ -1,40 +1,165 @@
 import os
+import threading
+import time
+import hashlib
 import requests
-from serpapi import GoogleSearch
-import json
+import orjson
+import cassettes
+from booking import get_engine
+from records import parse_movies, parse_reviews, parse_theaters, render_reviews
+from recommender import MovieIndex
 
+TMDB_BASE_URL = "https://api.themoviedb.org"
+SERPAPI_BASE_URL = "https://serpapi.com"
 
-def get_now_playing_movies():
-    url = "https://api.themoviedb.org/3/movie/now_playing?language=en-US&page=1"
-    headers = {"Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}"}
-    response = requests.get(url, headers=headers)
+# One pooled session per worker keeps TLS connections to TMDb and SerpAPI alive
+# between calls instead of handshaking on every request.
+session = cassettes.install(requests.Session())
 
-    if response.status_code != 200:
-        return f"Error fetching data: {response.status_code} - {response.reason}"
+# TMDb refreshes now-playing data a few times a day, so a short-lived copy is
+# shared by every chat in the worker.
+NOW_PLAYING_TTL = int(os.getenv("NOW_PLAYING_TTL_SECONDS", "600"))
+# (fetched_at, movies, fingerprint), always replaced as a whole so readers never
+# pair one refresh's movies with another's fingerprint
+_now_playing_cache = None
+_now_playing_lock = threading.Lock()
+_similarity_index = MovieIndex()
+
+# Titles asked about in recommend_similar() that aren't playing now, resolved
+# through TMDb search. What a title refers to rarely changes.
+SEARCH_TTL = int(os.getenv("MOVIE_SEARCH_TTL_SECONDS", "86400"))
+SEARCH_CACHE_MAX_ENTRIES = 256
+_search_cache = {}
+_search_lock = threading.Lock()
+
+
+def _fresh_now_playing():
+    cached = _now_playing_cache
+    if cached is not None and time.monotonic() - cached[0] < NOW_PLAYING_TTL:
+        return cached
+    return None
+
+
+def _now_playing_snapshot():
+    global _now_playing_cache
+    if cached := _fresh_now_playing():
+        return cached
+
+    # One refresh at a time; the others use its result
+    with _now_playing_lock:
+        if cached := _fresh_now_playing():
+            return cached
+
+        url = f"{TMDB_BASE_URL}/3/movie/now_playing?language=en-US&page=1"
+        headers = {"Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}"}
+        response = session.get(url, headers=headers)
 
-    data = response.json()
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Error fetching data: {response.status_code} - {response.reason}"
+            )
+
+        movies = parse_movies(response.content)
+        fingerprint = hashlib.sha1(orjson.dumps(movies)).hexdigest()
+        _now_playing_cache = (time.monotonic(), movies, fingerprint)
+        return _now_playing_cache
+
+
+def fetch_now_playing():
+    return _now_playing_snapshot()[1]
+
+
+def now_playing_fingerprint():
+    return _now_playing_snapshot()[2]
+
+
+def get_now_playing_movies():
+    try:
+        movies = fetch_now_playing()
+    except RuntimeError as e:
+        return str(e)
 
-    movies = data.get("results", [])
     if not movies:
         return "No movies are currently playing."
 
-    formatted_movies = "The TMDb API returned these movies:\n\n"
-
-    for movie in movies[:10]:  # Limit to 10 results
-        title = movie.get("title", "N/A")
-        movie_id = movie.get("id", "N/A")
-        release_date = movie.get("release_date", "N/A")
-        overview = movie.get("overview", "N/A")
-        formatted_movies += (
-            f"**Title:** {title}\n"
-            f"**Movie ID:** {movie_id}\n"
-            f"**Release Date:** {release_date}\n"
-            f"**Overview:** {overview}\n\n"
+    # Limit to 10 results
+    return "The TMDb API returned these movies:\n\n" + "".join(
+        movie.render() for movie in movies[:10]
+    )
+
+
+def search_movie(title):
+    # Returns TMDb's best match for the title, or None
+    key = title.lower()
+    with _search_lock:
+        cached = _search_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < SEARCH_TTL:
+        return cached[1]
+
+    url = f"{TMDB_BASE_URL}/3/search/movie"
+    params = {"query": title, "language": "en-US", "page": 1}
+    headers = {"Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}"}
+    response = session.get(url, params=params, headers=headers)
+
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"Error searching for {title}: {response.status_code} - {response.reason}"
         )
-    return formatted_movies
+
+    movies = parse_movies(response.content)
+    movie = movies[0] if movies else None
+    with _search_lock:
+        _search_cache.pop(key, None)
+        if len(_search_cache) >= SEARCH_CACHE_MAX_ENTRIES:
+            _search_cache.pop(next(iter(_search_cache)))
+        _search_cache[key] = (time.monotonic(), movie)
+    return movie
+
+
+def recommend_similar(title):
+    title = (title or "").strip()
+    if len(title) < 2:
+        raise ValueError("Please name the movie to base recommendations on.")
+
+    try:
+        movies = fetch_now_playing()
+    except RuntimeError as e:
+        return str(e)
+
+    # Cheap when the now-playing list hasn't changed since the last call
+    _similarity_index.update(movies)
+
+    if _similarity_index.find(title) is not None:
+        matches = _similarity_index.similar(title)
+    else:
+        # Not playing now, so compare against what the movie is about
+        try:
+            movie = search_movie(title)
+        except (RuntimeError, requests.RequestException) as e:
+            print(f"Debug - Movie search failed: {e}")
+            movie = None
+        if movie is None:
+            matches = _similarity_index.similar(title)
+        elif _similarity_index.find(movie.title) is not None:
+            matches = _similarity_index.similar(movie.title)
+        else:
+            matches = _similarity_index.similar(title, overview=movie.overview)
+
+    if not matches:
+        return f"No now-playing movies similar to {title} were found."
+
+    return f"Now-playing movies similar to {title}:\n" + "".join(
+        f"- {movie.title} (Movie ID: {movie.id})\n" for movie, _ in matches
+    )
 
 
 def get_showtimes(title, location):
+    # Like before, only the first theater is returned
+    return "".join(iter_showtimes(title, location, max_theaters=1))
+
+
+def iter_showtimes(title, location, max_theaters=None):
+    # Yields the formatted showtimes one theater at a time
     params = {
         "api_key": os.getenv("SERP_API_KEY"),
         "engine": "google",
@@ -49,68 +174,62 @@ def get_showtimes(title, location):
     print("Search Parameters:")
     print(params)
 
-    search = GoogleSearch(params)
-    results = search.get_dict()
-
-    if "showtimes" not in results:
-        return f"No showtimes found for {title} in {location}."
+    # Same request GoogleSearch(params).get_dict() makes, but over the pooled session
+    response = session.get(f"{SERPAPI_BASE_URL}/search.json", params=params)
+    theaters = parse_theaters(response.content)
 
-    showtimes = results["showtimes"][0]
+    if theaters is None:
+        yield f"No showtimes found for {title} in {location}."
+        return
 
-    # Debug: Print specific sections of the results
+    # Debug: Print the parsed theaters
     print("Debug - Showtimes section:")
-    print(json.dumps(results.get("showtimes", []), indent=2))
+    print(theaters)
 
-    formatted_showtimes = f"Showtimes for {title} in {location}:\n\n"
+    yield f"Showtimes for {title} in {location}:\n\n"
+    for theater in theaters[:max_theaters]:
+        yield theater.render()
+    yield "\n"
 
-    if showtimes["theaters"]:
-        theater = showtimes["theaters"][0]
-        theater_name = theater.get("name", "Unknown Theater")
-        formatted_showtimes += f"**{theater_name}**\n"
 
-        date = showtimes.get("day", "Unknown Date")
-        formatted_showtimes += f"  {date}:\n"
+def buy_ticket(theater, movie, showtime, hold_id=None, idempotency_key=None):
+    booking = get_engine().purchase(
+        theater, movie, showtime, hold_id=hold_id, idempotency_key=idempotency_key
+    )
+    return (
+        f"Ticket purchased for {movie} at {theater} for {showtime}. "
+        f"Confirmation number: {booking.booking_id}."
+    )
 
-        for showing in theater.get("showing", []):
-            for time in showing.get("time", []):
-                formatted_showtimes += f"    - {time}\n"
 
-    formatted_showtimes += "\n"
+def fetch_reviews(movie_id, page=1):
+    # Returns the page's reviews and the total number of pages
+    url = f"{TMDB_BASE_URL}/3/movie/{movie_id}/reviews?language=en-US&page={page}"
+    headers = {
+        "accept": "application/json",
+        "Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}",
+    }
+    response = session.get(url, headers=headers)
+    return parse_reviews(response.content)
 
-    return formatted_showtimes
 
+def get_reviews(movie_id):
+    reviews, _ = fetch_reviews(movie_id)
+    return render_reviews(reviews) or "No reviews found."
 
-def buy_ticket(theater, movie, showtime):
-    return f"Ticket purchased for {movie} at {theater} for {showtime}."
 
+def iter_reviews(movie_id, max_pages=1):
+    # Yields the formatted reviews one at a time, fetching pages as needed
+    page = 1
+    while True:
+        reviews, total_pages = fetch_reviews(movie_id, page)
+        if page == 1 and not reviews:
+            yield "No reviews found."
+            return
 
-def get_reviews(movie_id):
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}/reviews?language=en-US&page=1"
-    headers = {
-        "accept": "application/json",
-        "Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}",
-    }
-    response = requests.get(url, headers=headers)
-    reviews_data = response.json()
-
-    if "results" not in reviews_data or not reviews_data["results"]:
-        return "No reviews found."
-
-    formatted_reviews = ""
-    for review in reviews_data["results"]:
-        author = review.get("author", "N/A")
-        rating = review.get("author_details", {}).get("rating", "N/A")
-        content = review.get("content", "N/A")
-        created_at = review.get("created_at", "N/A")
-        url = review.get("url", "N/A")
-
-        formatted_reviews += (
-            f"**Author:** {author}\n"
-            f"**Rating:** {rating}\n"
-            f"**Content:** {content}\n"
-            f"**Created At:** {created_at}\n"
-            f"**URL:** {url}\n"
-            "----------------------------------------\n"
-        )
+        for review in reviews:
+            yield review.render()
 
-    return formatted_reviews
+        if page >= min(total_pages, max_pages):
+            return
+        page += 1
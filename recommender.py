@@ -0,0 +1,149 @@
+# Local similarity search over the now-playing movies.
+# Titles and overviews are turned into hashed TF-IDF vectors kept in one NumPy
+# matrix, so a lookup is a single matrix product. Hashing keeps the feature
+# space fixed, which lets the index add and drop movies as TMDb data refreshes
+# without re-vectorizing the movies it already has.
+
+import re
+import threading
+import zlib
+
+import numpy as np
+
+N_FEATURES = 2**12
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in into is it its "
+    "of on or she that the their them they this to was when where who will with".split()
+)
+
+
+def tokenize(text):
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def term_counts(texts, n_features=N_FEATURES):
+    counts = np.zeros((len(texts), n_features), dtype=np.float32)
+    for row, text in enumerate(texts):
+        # crc32 rather than hash(), which is salted per process
+        columns = [
+            zlib.crc32(token.encode()) % n_features for token in tokenize(text)
+        ]
+        np.add.at(counts[row], columns, 1)
+    return counts
+
+
+class MovieIndex:
+    def __init__(self, n_features=N_FEATURES):
+        self.n_features = n_features
+        self._lock = threading.Lock()
+        self._movies = []
+        self._counts = np.zeros((0, n_features), dtype=np.float32)
+        self._doc_freq = np.zeros(n_features, dtype=np.float32)
+        self._vectors = None
+        self._idf = None
+
+    def update(self, movies):
+        with self._lock:
+            current = {movie.id for movie in movies}
+            indexed = {movie.id for movie in self._movies}
+            if current == indexed:
+                return
+
+            keep = np.array(
+                [movie.id in current for movie in self._movies], dtype=bool
+            )
+            if not keep.all():
+                self._doc_freq -= (self._counts[~keep] > 0).sum(axis=0)
+                self._counts = self._counts[keep]
+                self._movies = [m for m, k in zip(self._movies, keep) if k]
+
+            new = [movie for movie in movies if movie.id not in indexed]
+            if new:
+                counts = term_counts(
+                    [f"{movie.title} {movie.overview}" for movie in new],
+                    self.n_features,
+                )
+                self._doc_freq += (counts > 0).sum(axis=0)
+                self._counts = np.vstack([self._counts, counts])
+                self._movies.extend(new)
+
+            # Weights depend on document frequencies, so rebuild on next query
+            self._vectors = None
+
+    def _weigh(self, counts):
+        weighted = np.log1p(counts) * self._idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return weighted / norms
+
+    def _ensure_vectors(self):
+        if self._vectors is None:
+            n = len(self._movies)
+            self._idf = np.log((1 + n) / (1 + self._doc_freq)) + 1
+            self._vectors = self._weigh(self._counts)
+
+    def _find(self, title):
+        # An exact title, or failing that a title containing it as whole words
+        # ("dune" finds "Dune: Part Two", "a" and "un" find nothing)
+        title = title.strip().lower()
+        if len(title) < 2:
+            return None
+        for row, movie in enumerate(self._movies):
+            if movie.title.lower() == title:
+                return row
+        pattern = re.compile(rf"\b{re.escape(title)}\b")
+        for row, movie in enumerate(self._movies):
+            if pattern.search(movie.title.lower()):
+                return row
+        return None
+
+    def find(self, title):
+        with self._lock:
+            row = self._find(title)
+            return None if row is None else self._movies[row]
+
+    def similar_batch(self, titles, k=3, overviews=None):
+        with self._lock:
+            if not self._movies:
+                return [[] for _ in titles]
+            self._ensure_vectors()
+
+            # Titles of indexed movies use that movie's vector; anything else
+            # is vectorized from its title and overview, if one is given. A
+            # title alone rarely shares words with any overview.
+            overviews = overviews or [""] * len(titles)
+            rows = [self._find(title) for title in titles]
+            queries = self._vectors[[row or 0 for row in rows]].copy()
+            unknown = [i for i, row in enumerate(rows) if row is None]
+            if unknown:
+                queries[unknown] = self._weigh(
+                    term_counts(
+                        [f"{titles[i]} {overviews[i]}" for i in unknown],
+                        self.n_features,
+                    )
+                )
+
+            scores = queries @ self._vectors.T
+            for i, row in enumerate(rows):
+                if row is not None:
+                    scores[i, row] = -np.inf
+
+            results = []
+            for i in range(len(titles)):
+                top = np.argsort(-scores[i])[:k]
+                results.append(
+                    [
+                        (self._movies[j], float(scores[i, j]))
+                        for j in top
+                        if scores[i, j] > 0
+                    ]
+                )
+            return results
+
+    def similar(self, title, k=3, overview=""):
+        return self.similar_batch([title], k, [overview])[0]
@@ -0,0 +1,115 @@
+# Compact records for the upstream payloads used by movie_functions.
+# Payloads are decoded with orjson and only the fields we render are copied
+# into slotted dataclasses, so the decoded dicts can be freed right away.
+
+from dataclasses import dataclass
+
+import orjson
+
+
+@dataclass(slots=True, frozen=True)
+class Movie:
+    id: int
+    title: str
+    release_date: str
+    overview: str
+
+    @classmethod
+    def from_json(cls, item):
+        return cls(
+            item.get("id", "N/A"),
+            item.get("title", "N/A"),
+            item.get("release_date", "N/A"),
+            item.get("overview", "N/A"),
+        )
+
+    def render(self):
+        return (
+            f"**Title:** {self.title}\n"
+            f"**Movie ID:** {self.id}\n"
+            f"**Release Date:** {self.release_date}\n"
+            f"**Overview:** {self.overview}\n\n"
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class Review:
+    author: str
+    rating: float
+    content: str
+    created_at: str
+    url: str
+
+    @classmethod
+    def from_json(cls, item):
+        return cls(
+            item.get("author", "N/A"),
+            (item.get("author_details") or {}).get("rating", "N/A"),
+            item.get("content", "N/A"),
+            item.get("created_at", "N/A"),
+            item.get("url", "N/A"),
+        )
+
+    def fragments(self):
+        # The content is passed through as-is instead of being copied into a
+        # per-review string, so joining many reviews copies each one only once
+        return (
+            f"**Author:** {self.author}\n**Rating:** {self.rating}\n**Content:** ",
+            self.content,
+            f"\n**Created At:** {self.created_at}\n**URL:** {self.url}\n"
+            "----------------------------------------\n",
+        )
+
+    def render(self):
+        return "".join(self.fragments())
+
+
+@dataclass(slots=True, frozen=True)
+class Showtime:
+    day: str
+    times: tuple
+
+    def render(self):
+        return f"  {self.day}:\n" + "".join(f"    - {time}\n" for time in self.times)
+
+
+@dataclass(slots=True, frozen=True)
+class Theater:
+    name: str
+    showtimes: tuple
+
+    @classmethod
+    def from_json(cls, item, day):
+        times = tuple(
+            time
+            for showing in item.get("showing", [])
+            for time in showing.get("time", [])
+        )
+        return cls(item.get("name", "Unknown Theater"), (Showtime(day, times),))
+
+    def render(self):
+        return f"**{self.name}**\n" + "".join(s.render() for s in self.showtimes)
+
+
+def parse_movies(payload):
+    return [Movie.from_json(item) for item in orjson.loads(payload).get("results", [])]
+
+
+def render_reviews(reviews):
+    return "".join(part for review in reviews for part in review.fragments())
+
+
+def parse_reviews(payload):
+    # Returns the page's reviews and the total number of pages
+    data = orjson.loads(payload)
+    items = data.get("results") or []
+    return [Review.from_json(item) for item in items], data.get("total_pages", 1)
+
+
+def parse_theaters(payload):
+    # SerpAPI groups showtimes by day; like before, only the first day is used
+    days = orjson.loads(payload).get("showtimes")
+    if not days:
+        return None
+    day = days[0].get("day", "Unknown Date")
+    return [Theater.from_json(item, day) for item in days[0].get("theaters", [])]
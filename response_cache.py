@@ -0,0 +1,98 @@
+import os
+import re
+import threading
+import time
+
+from movie_functions import now_playing_fingerprint
+
+# Opt-in cache for first-turn answers that don't depend on the user or the
+# conversation, e.g. "what movies are playing?".
+RESPONSE_CACHE_ENABLED = os.getenv("ENABLE_RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+# Tools whose output is the same for everyone. An answer may only be cached if
+# it used at least one tool and every tool it used is listed here; the
+# fingerprint of that tool's data is stored with the answer, so the entry is
+# dropped as soon as the data changes. Answers that used no tool have nothing
+# to go stale against and are left to the model.
+FINGERPRINTS = {
+    "get_now_playing_movies": now_playing_fingerprint,
+    # Its argument comes from the user message, which is already the cache key
+    "recommend_similar": now_playing_fingerprint,
+}
+
+# lookup() and store() run in worker threads, one per chat session
+_entries = {}
+_lock = threading.Lock()
+
+
+def normalize_message(text):
+    text = re.sub(r"[^\w\s]", "", text.lower())
+    return " ".join(text.split())
+
+
+def is_first_turn(message_history):
+    # Only the system prompt and the new user message
+    return len(message_history) == 2
+
+
+def current_fingerprints(tools):
+    # May refresh upstream data, so lookup() and store() block; the app calls
+    # them off the event loop
+    return {tool: FINGERPRINTS[tool]() for tool in tools}
+
+
+def lookup(message):
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+
+    key = normalize_message(message)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is None:
+        return None
+
+    try:
+        fresh = time.monotonic() < entry["expires_at"] and entry[
+            "fingerprints"
+        ] == current_fingerprints(entry["fingerprints"])
+    except Exception as e:
+        print(f"Debug - Response cache fingerprint failed: {e}")
+        fresh = False
+
+    if not fresh:
+        with _lock:
+            # Unless another session has stored a newer answer in the meantime
+            if _entries.get(key) is entry:
+                del _entries[key]
+        return None
+    return entry
+
+
+def store(message, tools_used, messages, prompt_sections):
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    if not tools_used or any(tool not in FINGERPRINTS for tool in tools_used):
+        return
+
+    try:
+        fingerprints = current_fingerprints(set(tools_used))
+    except Exception as e:
+        print(f"Debug - Response cache fingerprint failed: {e}")
+        return
+
+    key = normalize_message(message)
+    entry = {
+        "messages": [dict(m) for m in messages],
+        "answer": messages[-1]["content"],
+        "prompt_sections": list(prompt_sections),
+        "fingerprints": fingerprints,
+        "expires_at": time.monotonic() + RESPONSE_CACHE_TTL,
+    }
+    with _lock:
+        _entries.pop(key, None)
+        if len(_entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+            # dicts keep insertion order, so the first key is the oldest entry
+            _entries.pop(next(iter(_entries)))
+        _entries[key] = entry
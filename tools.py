@@ -0,0 +1,56 @@
+# Registers the movie tools with the core engine, along with their call
+# policies. Import this module before dispatching any tool calls.
+
+from core import register_tool
+from movie_functions import (
+    buy_ticket,
+    get_now_playing_movies,
+    get_reviews,
+    get_showtimes,
+    iter_reviews,
+    iter_showtimes,
+    recommend_similar,
+)
+
+register_tool(
+    get_now_playing_movies,
+    params=(),
+    description="Returns a list of movies currently playing in theaters.",
+    # movie_functions already keeps a TTL copy of the TMDb data
+    timeout=15,
+)
+register_tool(
+    get_showtimes,
+    params=("title", "location"),
+    description="Returns showtimes for a specific movie in a given location.",
+    cache_ttl=300,
+    timeout=20,
+    stream=iter_showtimes,
+    stream_kwargs={"max_theaters": 5},
+    stream_ready=2,
+)
+register_tool(
+    buy_ticket,
+    params=("theater", "movie", "showtime"),
+    description="Simulates buying a ticket for a specific showing.",
+    timeout=10,
+    concurrency="booking",
+)
+register_tool(
+    get_reviews,
+    params=("movie_id",),
+    description="Returns reviews for a specific movie.",
+    cache_ttl=600,
+    timeout=20,
+    stream=iter_reviews,
+    stream_kwargs={"max_pages": 3},
+    stream_ready=5,
+    # The first page, like get_reviews; later pages only go to the user
+    history_limit=20,
+)
+register_tool(
+    recommend_similar,
+    params=("title",),
+    description="Returns movies playing now that are similar to the given title.",
+    timeout=15,
+)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+import time
+
+import cassettes
+import movie_functions
+from booking import get_engine
+
+_lock = threading.Lock()
+_started = False
+_openai_task = None
+
+
+def _timed(timings, name, func):
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        print(f"Debug - Warm-up step {name} failed: {e}")
+    timings[name] = time.perf_counter() - start
+
+
+def _preconnect(base_url):
+    # Any response will do; the point is the DNS lookup and TLS handshake,
+    # after which the connection stays in the session's pool.
+    if cassettes.REPLAYING:
+        return
+    movie_functions.session.head(base_url, timeout=5)
+
+
+def _prefetch_now_playing():
+    # A replayed prefetch would take recorded responses out of order
+    if cassettes.REPLAYING:
+        return
+    if os.getenv("TMDB_API_ACCESS_TOKEN"):
+        movie_functions.fetch_now_playing()
+
+
+def warm_up():
+    timings = {}
+    start = time.perf_counter()
+    _timed(timings, "tmdb", lambda: _preconnect(movie_functions.TMDB_BASE_URL))
+    _timed(timings, "serpapi", lambda: _preconnect(movie_functions.SERPAPI_BASE_URL))
+    _timed(timings, "now_playing", _prefetch_now_playing)
+    # Opens SQLite and loads seat counts, which would otherwise happen on the
+    # event loop during the first purchase confirmation
+    _timed(timings, "booking", get_engine)
+    elapsed = time.perf_counter() - start
+    steps = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+    print(f"Warm-up finished in {elapsed:.2f}s ({steps})")
+    return timings
+
+
+def start_warm_up():
+    # Runs once per worker, in the background so app startup isn't delayed
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+async def _warm_up_openai(client):
+    if cassettes.REPLAYING:
+        return
+    start = time.perf_counter()
+    try:
+        await client.models.list()
+    except Exception as e:
+        print(f"Debug - Warm-up step openai failed: {e}")
+    print(f"OpenAI warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
+def start_openai_warm_up(client):
+    # The async client's connection pool belongs to the app's event loop, so
+    # this has to be started from inside it rather than from start_warm_up().
+    global _openai_task
+    if _openai_task is None:
+        _openai_task = asyncio.create_task(_warm_up_openai(client))